@@ -1,10 +1,77 @@
 '''
 Implementation of various Multi-Armed Bandit Algorithms and Strategies.
+
+If Numba is installed, the selection loops run through the compiled
+kernels in `mab_numba.py`.
 '''
 
-import operator
 import math
 import random
+import bisect
+import itertools
+from array import array
+from collections import defaultdict
+import numpy as np
+
+try:
+    import mab_numba
+except ImportError: # Numba is optional
+    mab_numba = None
+
+_INITIAL_CAPACITY = 8 # initial number of rows and columns of the CMAB tables
+_TS_NUMBA_MAX_ARMS = 128 # above this, NumPy's batched Beta sampler is faster
+_SCALAR_MAX_ARMS = 32 # up to this, a Python loop over the arms beats NumPy
+# SoftMax weights are kept within about exp(300) of its reference, a total 
+# weight below exp(-300) means the reference is stale and is worked out again
+_SOFTMAX_MAX_EXP = 300.0
+_SOFTMAX_MIN_TOTAL = math.exp(-_SOFTMAX_MAX_EXP)
+
+def _view(buf):
+    '''Return a NumPy array sharing the memory of the array.array `buf`,
+    it must be released before `buf` can grow.'''
+    return np.asarray(buf)
+
+def _rewards(arms, rewards):
+    '''Return `rewards` as a float array, making sure that there is one
+    reward for each of `arms`.'''
+    rewards = np.asarray(rewards, dtype=np.float64)
+    if rewards.shape!=(len(arms),):
+        raise ValueError(f"expected {len(arms)} rewards, got shape {rewards.shape}")
+    return rewards
+
+def _slots(model, arms):
+    '''Return the slots of `arms` in `model` as an integer array, 
+    allocating slots for arms not seen before.'''
+    if (isinstance(arms, np.ndarray) and arms.dtype.kind in "iu" and
+            (len(arms)==0 or (arms.min()>=0 and arms.max()<model._num_arms))):
+        return arms # registered integer arms are held in their own slots
+    if isinstance(arms, np.ndarray):
+        arms = arms.tolist()
+    slots = []
+    for arm in arms:
+        i = model._idx.get(arm)
+        slots.append(model._add_arm(arm) if i is None else i)
+    return np.array(slots, dtype=np.intp)
+
+# ln(n) for n = 1..1024 covering the early trials, kept as a list since 
+# indexing it is cheaper than both math.log and indexing a NumPy array
+_LOG_TABLE = np.log(np.arange(1, 1025, dtype=np.float64)).tolist()
+
+def _log(n):
+    '''Return ln(n) of a positive integer `n`.'''
+    return _LOG_TABLE[n-1] if 1<=n<=len(_LOG_TABLE) else math.log(n)
+
+_RNG = np.random.default_rng() # PCG64 generator shared by all instances
+
+def seed(s=None):
+    '''Seed all random number generators used by this module, i.e. the
+    shared NumPy generator, Python's `random` module and, if installed, 
+    the Numba kernels. Use this to make a simulation run reproducible.'''
+    global _RNG
+    _RNG = np.random.default_rng(s)
+    random.seed(s)
+    if mab_numba is not None:
+        mab_numba.seed(int(_RNG.integers(2**32)))
 
 ######################################################################
 ## Simple Multi-Armed Bandit 
@@ -14,43 +81,138 @@ class MAB:
     Simple Multi-armed Bandit implementation.
     '''
 
-    def __init__(self):
-        '''Constructor.'''
-        self.total_rewards = {}
-        self.total_count = {}
-        self.average_reward = {}
+    def __init__(self, num_arms=0, dtype=np.float64):
+        '''Constructor. If the arms are integers 0,1,...,`num_arms`-1, 
+        setting `num_arms` registers them upfront, so that each of 
+        these arms is held in the slot of its own number. Total rewards
+        are kept in `dtype`. Passing np.float32 halves the memory used, 
+        also keeping the counts in uint32, but float32 sums are only exact 
+        for rewards of 0 or 1 until an arm collects 2**24 and drift much 
+        earlier for other rewards, e.g. 3e5 rewards of 0.1 average 0.09973.'''
+        self._num_arms = num_arms
+        self._arms = list(range(num_arms))        # arm held by each slot
+        self._idx = dict(zip(self._arms,self._arms)) # arm -> slot
+        # the statistics of each slot are kept in array.array, which reads 
+        # and writes single elements as Python numbers far cheaper than
+        # NumPy does, `_view()` is used where all slots are worked at once
+        self._sum = array(np.dtype(dtype).char, [0])*num_arms # total reward
+        self._counts = array("I" if self._sum.itemsize<8 else "q", [0])*num_arms
+        self._best = -1 # slot of the best arm, -1 if it needs a rescan
+        self._best_value = 0.0
 
     def description(self) -> str:
         '''Return a string which describes the algorithm.'''
         return "Simple MAB"
 
+    @property
+    def total_rewards(self):
+        '''Dictionary of the total reward of each arm.'''
+        return dict(zip(self._arms, self._sum))
+
+    @property
+    def total_count(self):
+        '''Dictionary of how many times each arm has been selected.'''
+        return dict(zip(self._arms, self._counts))
+
+    @property
+    def average_reward(self):
+        '''Dictionary of the average reward of each arm.'''
+        return dict(zip(self._arms, self._averages().tolist()))
+
+    def _averages(self):
+        '''Return the average reward of all arms by slot, which is 0 for
+        an arm never selected. Averages are only worked out on demand.'''
+        counts = _view(self._counts)
+        return np.divide(_view(self._sum), counts, out=np.zeros(len(counts)), 
+                         where=counts>0)
+
+    def _average(self, i):
+        '''Return the average reward of the arm in slot `i`.'''
+        count = self._counts[i]
+        if count==0: return 0.0
+        return self._sum[i]/count
+
+    def _add_arm(self, arm):
+        '''Allocate a slot in the backing arrays for a new `arm` and
+        return it.'''
+        i = self._idx[arm] = len(self._arms)
+        self._arms.append(arm)
+        self._sum.append(0)
+        self._counts.append(0)
+        return i
+
     def update_reward(self, arm, reward):
         '''Use this method to update the algorithm which `arm` has been
         selected and what `reward` has been observed from the environment.'''
-        if arm not in self.total_rewards: # new arm?
-            self.total_rewards[arm] = 0
-            self.total_count[arm] = 0
-        self.total_count[arm] += 1
-        self.total_rewards[arm] += reward
-        self.average_reward[arm] = self.total_rewards[arm]/self.total_count[arm]
+        i = self._idx.get(arm)
+        if i is None: # new arm?
+            i = self._add_arm(arm)
+        self._sum[i] += reward # first, so a bad `reward` records nothing
+        self._counts[i] += 1
+        # keep track of the best arm found by `get_best_arm()`, only this
+        # arm has changed so comparing it with the best arm is enough, 
+        # unless it was the best arm and its average has dropped
+        best = self._best
+        if best<0: 
+            return
+        avg = self._sum[i]/self._counts[i]
+        if i==best:
+            if avg<self._best_value:
+                self._best = -1
+            else:
+                self._best_value = avg
+        elif avg>self._best_value or (avg==self._best_value and i<best):
+            self._best = i
+            self._best_value = avg
+
+    def update_batch(self, arms, rewards):
+        '''Update the algorithm with many observations at once, where 
+        `arms[k]` has been selected and `rewards[k]` has been observed. 
+        This is equivalent to calling `update_reward()` for each pair.'''
+        rewards = _rewards(arms, rewards)
+        slots = _slots(self, arms)
+        n = len(self._arms)
+        # work out both increments before applying either of them
+        new_counts = np.bincount(slots, minlength=n)
+        new_sums = np.bincount(slots, weights=rewards, minlength=n)
+        counts = _view(self._counts)
+        counts += new_counts.astype(counts.dtype)
+        sums = _view(self._sum)
+        sums += new_sums
+        self._best = -1
 
     def get_reward(self, arm):
         '''Get the reward for a particular `arm`.'''
-        if arm not in self.average_reward: return 0
-        return self.average_reward[arm]
+        i = self._idx.get(arm)
+        if i is None: return 0
+        return self._average(i)
 
     def get_arm_count(self, arm):
         '''Return how many times have this `arm` been selected.'''
-        if arm not in self.total_count: return 0
-        return self.total_count[arm]
+        i = self._idx.get(arm)
+        if i is None: return 0
+        return self._counts[i]
 
     def get_best_arm(self):
         '''Return a tuple (arm,reward) representing the best arm and
         the corresponding average reward. If this arm has not been 
         seen by the algorithm, it simply returns (None,None).'''
-        if len(self.average_reward)==0: 
+        n = len(self._arms)
+        if n==0: 
             return (None,None)
-        return max(self.average_reward.items(), key=operator.itemgetter(1))
+        if self._best<0:
+            if n<=_SCALAR_MAX_ARMS:
+                best, best_value = 0, -math.inf
+                for i,(total,count) in enumerate(zip(self._sum,self._counts)):
+                    avg = total/count if count else 0.0
+                    if avg>best_value:
+                        best, best_value = i, avg
+                self._best, self._best_value = best, best_value
+            else:
+                avg = self._averages()
+                self._best = int(avg.argmax())
+                self._best_value = avg[self._best]
+        return (self._arms[self._best],float(self._best_value))
  
 
 ######################################################################
@@ -61,12 +223,12 @@ class UCB1(MAB):
     Upper Confidence Bound (UCB) implementation.
     '''
 
-    def __init__(self, beta=1.0):
-        '''Constructor.'''
-        super().__init__()
+    def __init__(self, beta=1.0, num_arms=0, dtype=np.float64):
+        '''Constructor. See `MAB` for `num_arms` and `dtype`.'''
+        super().__init__(num_arms, dtype)
         self.beta = beta
         self.overall_total_count = 0
-        self.ucb = 0
+        self._last_arm = None
 
     def description(self):
         '''Return a string which describes the algorithm.'''
@@ -74,19 +236,63 @@ class UCB1(MAB):
 
     def update_reward(self, arm, reward):
         '''Use this method to update the algorithm which `arm` has been
-        selected and what `reward` has been observed from the environment.'''
-        if arm not in self.total_rewards: 
-            self.total_rewards[arm] = 0
-            self.total_count[arm] = 0
-        self.total_count[arm] += 1
+        selected and what `reward` has been observed from the environment.
+        The exploration bonus is not stored, it is added when selecting.'''
+        super().update_reward(arm, reward)
         self.overall_total_count += 1
-        self.ucb =  math.sqrt(2*self.beta*math.log(self.total_count[arm])/self.total_count[arm])
-        ucb_reward = reward + self.ucb
-        self.total_rewards[arm] += ucb_reward
-        self.average_reward[arm] = self.total_rewards[arm]/self.total_count[arm]
+        self._last_arm = arm
+
+    def update_batch(self, arms, rewards):
+        '''Update the algorithm with many observations at once, where 
+        `arms[k]` has been selected and `rewards[k]` has been observed. 
+        This is equivalent to calling `update_reward()` for each pair.'''
+        super().update_batch(arms, rewards)
+        if len(arms)!=0:
+            self.overall_total_count += len(arms)
+            # keep the arm as stored by `_slots()`, not as a NumPy scalar
+            self._last_arm = arms[-1:].tolist()[0] if isinstance(arms, np.ndarray) else arms[-1]
+
+    def get_best_arm(self):
+        '''Return a tuple (arm,ucb) representing the best arm and its
+        upper confidence bound, i.e. the average reward plus the UCB radius
+        sqrt(2*beta*ln(T)/N). If no arm has been seen by the algorithm, 
+        it simply returns (None,None).'''
+        n = len(self._arms)
+        if n==0: 
+            return (None,None)
+        if n<=_SCALAR_MAX_ARMS:
+            two_beta_log_T = 2*self.beta*_log(max(self.overall_total_count,1))
+            best, best_score = 0, -math.inf
+            for i,(total,count) in enumerate(zip(self._sum,self._counts)):
+                if count==0: # an unselected arm has infinite bonus
+                    return (self._arms[i],math.inf)
+                score = total/count + math.sqrt(two_beta_log_T/count)
+                if score>best_score:
+                    best, best_score = i, score
+            return (self._arms[best],best_score)
+        counts, sums = _view(self._counts), _view(self._sum)
+        if mab_numba is not None:
+            i = mab_numba.ucb1_select(counts,sums,self.overall_total_count,self.beta)
+            return (self._arms[i],self._average(i)+self._bonus(i))
+        if not counts.all(): # an unselected arm has infinite bonus
+            i = int(counts.argmin())
+            return (self._arms[i],math.inf)
+        inv_counts = np.reciprocal(counts, dtype=sums.dtype)
+        scores = sums*inv_counts + np.sqrt(2*self.beta*_log(self.overall_total_count)
+                                                    * inv_counts)
+        i = int(scores.argmax())
+        return (self._arms[i],float(scores[i]))
+
+    def _bonus(self, i):
+        '''Return the UCB radius of the arm in slot `i`.'''
+        count = self._counts[i]
+        if count==0: return math.inf
+        return math.sqrt(2*self.beta*_log(self.overall_total_count)/count)
 
     def get_last_ucb(self):
-        return self.ucb
+        '''Return the current UCB radius of the last updated arm.'''
+        if self._last_arm is None: return 0
+        return self._bonus(self._idx[self._last_arm])
 
 
 ######################################################################
@@ -97,58 +303,132 @@ class TS:
     Multi-armed Bandit with Thompson Sampling technique.
     '''
 
-    def __init__(self):
-        '''Constructor.'''
-        self.total_count = {}
-        self.alpha = {}
-        self.beta = {}
-        self.last_drawn = {}
+    def __init__(self, num_arms=0, use_stdlib_rng=False):
+        '''Constructor. See `MAB` for `num_arms`. Set `use_stdlib_rng` to 
+        draw with `random.betavariate()` one arm at a time, e.g. to replay
+        runs seeded through Python's `random` module.'''
+        self._num_arms = num_arms
+        self._arms = list(range(num_arms))        # arm held by each slot
+        self._idx = dict(zip(self._arms,self._arms)) # arm -> slot
+        # rewards are either 0 or 1, so the Beta(alpha,beta) parameters 
+        # are integers and alpha+beta-2 is the number of selections, they
+        # are kept in array.array like the statistics of `MAB`
+        self._alphas = array("i", [1])*num_arms
+        self._betas = array("i", [1])*num_arms
+        self._last = array("d", [0.0])*num_arms # last drawn value by slot
+        self.use_stdlib_rng = use_stdlib_rng
 
     def description(self) -> str:
         '''Return a string which describes the algorithm.'''
         return "Multi-armed Bandit with Thompson Sampling technique"
 
+    @property
+    def total_count(self):
+        '''Dictionary of how many times each arm has been selected.'''
+        return {arm:a+b-2 for arm,a,b in zip(self._arms,self._alphas,self._betas)}
+
+    @property
+    def alpha(self):
+        '''Dictionary of the alpha parameter of each arm.'''
+        return dict(zip(self._arms, self._alphas))
+
+    @property
+    def beta(self):
+        '''Dictionary of the beta parameter of each arm.'''
+        return dict(zip(self._arms, self._betas))
+
+    @property
+    def last_drawn(self):
+        '''Dictionary of the last drawn value of each arm.'''
+        return dict(zip(self._arms, self._last))
+
+    def _add_arm(self, arm):
+        '''Allocate a slot in the backing arrays for a new `arm` and
+        return it.'''
+        i = self._idx[arm] = len(self._arms)
+        self._arms.append(arm)
+        self._alphas.append(1)
+        self._betas.append(1)
+        self._last.append(0.0)
+        return i
+
     def update_reward(self, arm, reward):
         '''Use this method to update the algorithm which `arm` has been
         selected and what `reward` (must be either 0 or 1) has been observed 
         from the environment.'''
-        if arm not in self.total_count: # new arm?
-            self.alpha[arm] = 1
-            self.beta[arm] = 1
-            self.total_count[arm] = 0
-            self.last_drawn[arm] = 0
-        self.total_count[arm] += 1
-        self.alpha[arm] += reward
-        self.beta[arm]  += 1-reward
+        if reward!=0 and reward!=1:
+            raise ValueError(f"TS reward must be either 0 or 1, not {reward!r}")
+        i = self._idx.get(arm)
+        if i is None: # new arm?
+            i = self._add_arm(arm)
+        if reward:
+            self._alphas[i] += 1
+        else:
+            self._betas[i] += 1
+
+    def update_batch(self, arms, rewards):
+        '''Update the algorithm with many observations at once, where 
+        `arms[k]` has been selected and `rewards[k]` (must be either 0 or 1)
+        has been observed. This is equivalent to calling `update_reward()` 
+        for each pair.'''
+        rewards = _rewards(arms, rewards)
+        if not ((rewards==0)|(rewards==1)).all():
+            raise ValueError("TS rewards must be either 0 or 1")
+        slots = _slots(self, arms)
+        n = len(self._arms)
+        wins = np.bincount(slots, weights=rewards, minlength=n).astype(np.int32)
+        alphas, betas = _view(self._alphas), _view(self._betas)
+        alphas += wins
+        betas += np.bincount(slots, minlength=n).astype(np.int32) - wins
 
     def get_reward(self, arm):
         '''Get the reward for a particular `arm`. 
         This is $\frac{\alpha-1}{(\alpha-1)+(\beta-1)}$.'''
-        if arm not in self.total_count: return 0
-        return (self.alpha[arm]-1) / (self.alpha[arm]-1+self.beta[arm]-1)
+        i = self._idx.get(arm)
+        if i is None: return 0
+        wins = self._alphas[i] - 1
+        count = wins + self._betas[i] - 1
+        if count==0: return 0
+        return wins / count
 
     def get_arm_count(self, arm):
         '''Return how many times have this `arm` been selected.'''
-        if arm not in self.total_count: return 0
-        return self.total_count[arm]
+        i = self._idx.get(arm)
+        if i is None: return 0
+        return self._alphas[i] - 1 + self._betas[i] - 1
 
     def get_best_arm(self):
         '''Return a tuple (arm,reward) representing the best arm and
         the corresponding average reward. If this arm has not been 
         seen by the algorithm, it simply returns (None,None).'''
-        best_arm = { "arm":None, "value":0.0 }
-        for arm in self.total_count:
-            self.last_drawn[arm] = random.betavariate(self.alpha[arm],self.beta[arm])
-            if self.last_drawn[arm]>=best_arm["value"]:
-                best_arm["arm"] = arm
-                best_arm["value"] = self.last_drawn[arm]
-        if best_arm["arm"] is None: 
+        n = len(self._arms)
+        if n==0: 
             return (None,None)
-        return (best_arm["arm"],best_arm["value"])
+        if self.use_stdlib_rng:
+            best_arm, best_value = None, 0.0
+            draws = []
+            for arm,a,b in zip(self._arms,self._alphas,self._betas):
+                value = random.betavariate(a,b)
+                draws.append(value)
+                if value>=best_value:
+                    best_arm, best_value = arm, value
+            self._last = array("d", draws)
+            return (best_arm,best_value)
+        alphas, betas = _view(self._alphas), _view(self._betas)
+        if mab_numba is not None and n<=_TS_NUMBA_MAX_ARMS:
+            i = mab_numba.ts_select(alphas,betas,_view(self._last))
+            return (self._arms[i],self._last[i])
+        # draw from the Beta distributions of all arms in one call, 
+        # `Generator.beta()` already takes the Gamma ratio in C
+        draws = _RNG.beta(alphas,betas)
+        _view(self._last)[:] = draws
+        i = int(draws.argmax())
+        return (self._arms[i],float(draws[i]))
 
     def get_last_drawn_value(self, arm):
-        if arm not in self.last_drawn: return 0
-        return self.last_drawn[arm]
+        i = self._idx.get(arm)
+        if i is None: return 0
+        return self._last[i]
 
 
 ######################################################################
@@ -159,40 +439,108 @@ class SoftMax(MAB):
     Boltzmann Exploration (Softmax).
     '''
 
-    def __init__(self, tau=1.0):
-        '''Constructor.'''
-        super().__init__()
+    def __init__(self, tau=1.0, num_arms=0, dtype=np.float64):
+        '''Constructor. See `MAB` for `num_arms` and `dtype`.'''
+        super().__init__(num_arms, dtype)
         self.tau = tau
+        # Boltzmann weight by slot, kept as exp((average-ref)/tau) relative
+        # to a reference average so that `exp()` never overflows
+        self._ref = 0.0
+        self._w = array("d", [1.0])*num_arms
 
     def description(self) -> str:
         '''Return a string which describes the algorithm.'''
         return "Boltzmann Exploration (Softmax)"
 
+    def _add_arm(self, arm):
+        '''Allocate a slot for a new `arm` and give it the weight of an
+        average reward of 0.'''
+        i = super()._add_arm(arm)
+        self._w.append(0.0)
+        self._set_weight(i, 0.0)
+        return i
+
+    def _set_weight(self, i, avg):
+        '''Set the weight of slot `i` from its average reward `avg`. If
+        this weight grows too large, `avg` becomes the new reference and 
+        the other weights are scaled down accordingly.'''
+        x = (avg-self._ref)/self.tau
+        if x>_SOFTMAX_MAX_EXP:
+            w = _view(self._w)
+            w *= math.exp(-x)
+            self._ref = avg
+            x = 0.0
+        self._w[i] = math.exp(x)
+
+    def _reweight(self):
+        '''Work out all weights again with the largest average reward as 
+        the reference, e.g. after the weights have all become tiny because
+        the average reward of the reference arm has dropped.'''
+        avg = self._averages()
+        self._ref = float(avg.max())
+        _view(self._w)[:] = np.exp((avg-self._ref)/self.tau)
+
+    def _cdf(self):
+        '''Return the cumulative sum of the weights by slot.'''
+        if len(self._w)<=_SCALAR_MAX_ARMS:
+            return list(itertools.accumulate(self._w))
+        return np.cumsum(_view(self._w))
+
+    def update_reward(self, arm, reward):
+        '''Use this method to update the algorithm which `arm` has been
+        selected and what `reward` has been observed from the environment.'''
+        # this does not go through `MAB.update_reward()`, as SoftMax has
+        # no use for its best arm tracking and the slot is needed here
+        i = self._idx.get(arm)
+        if i is None: # new arm?
+            i = self._add_arm(arm)
+        self._sum[i] += reward
+        self._counts[i] += 1
+        # only the weight of this arm changes, so refresh it here rather
+        # than exponentiating every arm each time a choice is made
+        self._set_weight(i, self._sum[i]/self._counts[i])
+
+    def update_batch(self, arms, rewards):
+        '''Update the algorithm with many observations at once, where 
+        `arms[k]` has been selected and `rewards[k]` has been observed. 
+        This is equivalent to calling `update_reward()` for each pair.'''
+        super().update_batch(arms, rewards)
+        if len(self._arms)!=0:
+            self._reweight()
+
     def get_best_arm(self):
         '''Return a tuple (arm,reward) representing the best arm and
         the corresponding average reward. If this arm has not been 
         seen by the algorithm, it simply returns (None,None).'''
-        if len(self.average_reward)==0: 
+        if len(self._arms)==0: 
             return (None,None) # nothing in Q-table yet, do exploration
-        arm_list = [arm for arm in self.average_reward]
-        arm_weight = [math.exp(reward/self.tau) for reward in self.average_reward.values()]
-        # note that we don't need to divide the denominator because 
-        # `random.choices()` will scale `arm_weight` automatically
-        choice = random.choices(arm_list,arm_weight)[0]
-        return (choice,self.average_reward[choice])
+        cdf = self._cdf()
+        if cdf[-1]<_SOFTMAX_MIN_TOTAL:
+            self._reweight()
+            cdf = self._cdf()
+        # note that we don't need to normalize the weights, instead we scale
+        # the uniform draw by the total weight, which is the last element of 
+        # `cdf` so the draw can never land past the end, then invert `cdf`
+        i = bisect.bisect_left(cdf, random.random()*cdf[-1])
+        return (self._arms[i],self._average(i))
 
     def get_prob_list(self):
         '''Get the probability dictionary for all arms. Each quantity describes
         the probability that an arm will be picked.'''
-        arm_prob = {}
-        weigth_sum = 0
-        if len(self.average_reward)!=0:
-            for arm,reward in self.average_reward.items():
-                arm_prob[arm] = math.exp(reward/self.tau)
-                weigth_sum += arm_prob[arm]
-            for arm in arm_prob:
-                arm_prob[arm] /= weigth_sum
-        return(arm_prob)
+        if len(self._arms)==0:
+            return {}
+        if len(self._w)<=_SCALAR_MAX_ARMS:
+            total = sum(self._w)
+            if total<_SOFTMAX_MIN_TOTAL:
+                self._reweight()
+                total = sum(self._w)
+            return {arm:w/total for arm,w in zip(self._arms,self._w)}
+        w = _view(self._w)
+        total = w.sum()
+        if total<_SOFTMAX_MIN_TOTAL:
+            self._reweight()
+            total = w.sum()
+        return dict(zip(self._arms, (w/total).tolist()))
 
 ######################################################################
 ## Simple Discrete Contextual MAB
@@ -204,34 +552,116 @@ class CMAB:
     using Multi-UCB1.
     '''
 
-    def __init__(self):
-        '''Constructor.'''
-        self.mab = {}
+    def __init__(self, beta=1.0, dtype=np.float64):
+        '''Constructor. See `MAB` for `dtype`.'''
+        self.beta = beta
+        # a new context or arm is given the next row or column on first use
+        self._ctx_idx = defaultdict(itertools.count().__next__) # context -> row
+        self._arm_idx = defaultdict(itertools.count().__next__) # arm -> column
+        self._arms = []    # arm held by each column
+        # a UCB1 model for each context, stored as one row of these tables
+        count_dtype = np.uint32 if np.dtype(dtype).itemsize<8 else np.int64
+        self._sum = np.zeros((_INITIAL_CAPACITY,_INITIAL_CAPACITY), dtype=dtype)
+        self._counts = np.zeros((_INITIAL_CAPACITY,_INITIAL_CAPACITY), dtype=count_dtype)
+        self._total = np.zeros(_INITIAL_CAPACITY, dtype=count_dtype) # T by row
 
     def description(self):
         '''Return a string which describes the algorithm.'''
         return "Contextual MAB using Multi-UCB1"
 
+    def _grow(self):
+        '''Double the number of rows and/or columns of the tables until
+        they can hold all contexts and arms.'''
+        rows, cols = self._sum.shape
+        while len(self._ctx_idx)>rows:
+            rows *= 2
+        while len(self._arm_idx)>cols:
+            cols *= 2
+        total = np.zeros(rows, dtype=self._total.dtype)
+        total[:len(self._total)] = self._total
+        self._total = total
+        for name in ("_sum","_counts"):
+            old = getattr(self, name)
+            new = np.zeros((rows,cols), dtype=old.dtype)
+            new[:old.shape[0],:old.shape[1]] = old
+            setattr(self, name, new)
+
     def update_reward(self, arm, reward, context=None):
         '''Use this method to update the algorithm which `arm` has been
         selected under which `context, and what `reward` has been observed 
         from the environment.'''
-        if context not in self.mab: 
-            self.mab[context] = UCB1() # we use UCB1 model for each context
-        self.mab[context].update_reward(arm, reward)
+        ci = self._ctx_idx[context]
+        ai = self._arm_idx[arm]
+        if ai==len(self._arms): # new arm?
+            self._arms.append(arm)
+        if ci>=self._sum.shape[0] or ai>=self._sum.shape[1]:
+            self._grow()
+        self._sum[ci,ai] += reward # first, so a bad `reward` records nothing
+        self._counts[ci,ai] += 1
+        self._total[ci] += 1
+
+    def update_batch(self, arms, rewards, contexts=None):
+        '''Update the algorithm with many observations at once, where 
+        `arms[k]` has been selected under `contexts[k]` and `rewards[k]` 
+        has been observed. This is equivalent to calling `update_reward()` 
+        for each triple, `contexts` defaults to the context None.'''
+        rewards = _rewards(arms, rewards)
+        if contexts is not None and len(contexts)!=len(arms):
+            raise ValueError(f"expected {len(arms)} contexts, got {len(contexts)}")
+        # store NumPy arms and contexts as Python objects, like `update_reward()`
+        if isinstance(arms, np.ndarray):
+            arms = arms.tolist()
+        if contexts is None:
+            contexts = itertools.repeat(None, len(arms))
+        elif isinstance(contexts, np.ndarray):
+            contexts = contexts.tolist()
+        rows = np.array([self._ctx_idx[context] for context in contexts], dtype=np.intp)
+        cols = np.array([self._arm_idx[arm] for arm in arms], dtype=np.intp)
+        if len(self._arm_idx)>len(self._arms): # new arms?
+            self._arms.extend(itertools.islice(self._arm_idx, len(self._arms), None))
+        if len(self._ctx_idx)>self._sum.shape[0] or len(self._arm_idx)>self._sum.shape[1]:
+            self._grow()
+        np.add.at(self._counts, (rows,cols), 1)
+        np.add.at(self._sum, (rows,cols), rewards)
+        self._total += np.bincount(rows, minlength=len(self._total)).astype(self._total.dtype)
 
     def get_reward(self, arm, context=None):
         '''Get the reward for a particular `arm` under this `context`.'''
-        if context not in self.mab: # new context?
+        ci = self._ctx_idx.get(context)
+        ai = self._arm_idx.get(arm)
+        if ci is None or ai is None or self._counts[ci,ai]==0: 
             return 0 
-        return self.mab[context].get_reward(arm)
+        return float(self._sum[ci,ai]/self._counts[ci,ai])
 
     def get_best_arm(self, context=None):
-        '''Return a tuple (arm,reward) representing the best arm and
-        the corresponding average reward. If this context has not been 
-        seen by the algorithm, it simply returns (None,None).'''
-        if context not in self.mab: return (None,None)
-        return self.mab[context].get_best_arm()
+        '''Return a tuple (arm,ucb) representing the best arm and its
+        upper confidence bound under this `context`. If this context has 
+        not been seen by the algorithm, it simply returns (None,None).'''
+        ci = self._ctx_idx.get(context)
+        if ci is None: return (None,None)
+        T = int(self._total[ci])
+        if T==0: return (None,None) # no arm selected under this context yet
+        n = len(self._arms)
+        if n<=_SCALAR_MAX_ARMS:
+            two_beta_log_T = 2*self.beta*_log(T)
+            best, best_score = 0, -math.inf
+            for i,(total,count) in enumerate(zip(self._sum[ci,:n].tolist(),
+                                                 self._counts[ci,:n].tolist())):
+                if count==0: # not selected under this context, not a candidate
+                    continue
+                score = total/count + math.sqrt(two_beta_log_T/count)
+                if score>best_score:
+                    best, best_score = i, score
+            return (self._arms[best],best_score)
+        counts = self._counts[ci,:n]
+        selected = counts>0 
+        # arms never selected under this context are not candidates
+        scores = np.full(n, -np.inf, dtype=self._sum.dtype)
+        inv_counts = np.reciprocal(counts[selected], dtype=self._sum.dtype)
+        scores[selected] = (self._sum[ci,:n][selected]*inv_counts 
+                            + np.sqrt(2*self.beta*_log(T)*inv_counts))
+        i = int(scores.argmax())
+        return (self._arms[i],float(scores[i]))
 
 
 ######################################################################
@@ -248,11 +678,19 @@ class CMAB2(MAB):
     def __init__(self):
         '''Constructor.'''
         super().__init__()
+        self._feature_slots = {} # feature -> slots of its contexts
 
     def description(self):
         '''Return a string which describes the algorithm.'''
         return "Contextual MAB using Summarized Contexts"
 
+    def _add_arm(self, context):
+        '''Allocate a slot for a new `context` and also index the slot
+        under the feature of this `context`.'''
+        i = super()._add_arm(context)
+        self._feature_slots.setdefault(context[0],[]).append(i)
+        return i
+
     def context(self, feature, action=None):
         '''Return the context summarizing feature and action.'''
         return (feature,action)
@@ -266,12 +704,22 @@ class CMAB2(MAB):
         '''Return a tuple (action,reward) representing the best arm and
         the corresponding average reward. If this context has not been 
         seen by the algorithm, it simply returns (None,None).'''
-        best_action = (None,None)  # (action,reward)
-        for cnx in self.average_reward:
-            if cnx[0]==context[0]: # context=(feature,action)
-                if best_action[0] is None or best_action[1]<self.average_reward[cnx]:
-                    best_action = (cnx[1],self.average_reward[cnx])
-        return best_action
+        slots = self._feature_slots.get(context[0]) # context=(feature,action)
+        if slots is None: 
+            return (None,None)
+        if len(slots)<=_SCALAR_MAX_ARMS:
+            best, best_value = slots[0], -math.inf
+            for i in slots:
+                count = self._counts[i]
+                avg = self._sum[i]/count if count else 0.0
+                if avg>best_value:
+                    best, best_value = i, avg
+            return (self._arms[best][1],best_value)
+        counts = _view(self._counts)[slots]
+        avg = np.divide(_view(self._sum)[slots], counts, out=np.zeros(len(slots)),
+                        where=counts>0)
+        j = int(avg.argmax())
+        return (self._arms[slots[j]][1],float(avg[j]))
 
 
 ####################################################################
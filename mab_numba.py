@@ -0,0 +1,42 @@
+'''
+Numba-compiled kernels for the hot loops of `mab.py`. This module
+is optional, `mab.py` falls back to NumPy when Numba is not installed.
+'''
+
+import math
+import numpy as np
+from numba import njit
+
+@njit(cache=True)
+def ts_select(alphas, betas, drawn):
+    '''Draw a value from Beta(`alphas[i]`,`betas[i]`) for every slot `i`,
+    store the values in `drawn` and return the slot with the largest one.'''
+    best = 0
+    for i in range(len(alphas)):
+        drawn[i] = np.random.beta(alphas[i], betas[i])
+        if drawn[i]>drawn[best]:
+            best = i
+    return best
+
+@njit(cache=True)
+def ucb1_select(counts, sum_rewards, total, beta):
+    '''Return the slot with the largest UCB1 score 
+    `sum_rewards[i]/counts[i] + sqrt(2*beta*ln(total)/counts[i])`.
+    A slot which has never been selected has an infinite score.'''
+    two_beta_log_T = 2.0*beta*math.log(max(total,1))
+    best = 0
+    best_score = -np.inf
+    for i in range(len(counts)):
+        if counts[i]==0:
+            return i
+        score = sum_rewards[i]/counts[i] + math.sqrt(two_beta_log_T/counts[i])
+        if score>best_score:
+            best = i
+            best_score = score
+    return best
+
+@njit(cache=True)
+def seed(s):
+    '''Seed the random number generator used by the kernels, which is
+    separate from NumPy's.'''
+    np.random.seed(s)